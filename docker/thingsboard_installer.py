@@ -1,62 +1,162 @@
 #!/usr/bin/env python3
 
+import argparse
+import asyncio
+import atexit
 import os
 import subprocess
+import functools
 import getpass
-import random
-import string
+import grp
+import json
 import logging
-import psutil
+import pwd
+import readline  # noqa: F401 — enables line editing/history in input()
 import time
-import requests
-import smtplib
-from email.mime.text import MIMEText
-from termcolor import colored
+from concurrent.futures import ThreadPoolExecutor
+
+# smtplib and email.mime.text are imported lazily inside the functions
+# that need them so the menu renders without paying their import cost
+# up front.
 
 # Logging configuration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger()
 
-def run_command(command, description=""):
-    """Run a shell command and handle errors."""
+# Populated by the argparse block under __main__; the defaults keep the
+# module importable without command-line arguments.
+cli_args = argparse.Namespace(upgrade_host=False, yes=False,
+                              http_port=8080, mqtt_port=1883, coap_port=5683)
+
+async def run_command(command, description="", check=True, stream=False):
+    """Run an argv-list command asynchronously and handle errors.
+
+    No shell is involved, so arguments are passed to the child verbatim
+    and there is no intermediate /bin/sh fork. Pass check=False for
+    commands whose failure is expected and harmless (e.g. creating a
+    group that already exists). Pass stream=True for long-running
+    commands (apt install, docker pull) to relay their output to the
+    logger line by line; otherwise stdout is discarded so a chatty
+    child can never fill the 64 KB pipe buffer and block.
+    """
     logger.info(description)
     try:
-        subprocess.run(command, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    except subprocess.CalledProcessError as e:
+        if stream:
+            proc = await asyncio.create_subprocess_exec(
+                *command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        else:
+            proc = await asyncio.create_subprocess_exec(
+                *command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except FileNotFoundError as e:
+        # Without a shell there is no exit code 127; a missing binary
+        # surfaces here instead.
+        logger.error(f"Failed to execute: {command}")
+        logger.error(str(e))
+        exit(1)
+    if stream:
+        while True:
+            line = await proc.stdout.readline()
+            if not line:
+                break
+            logger.info(line.decode(errors="replace").rstrip())
+        await proc.wait()
+        stderr_text = ""
+    else:
+        _, stderr = await proc.communicate()
+        stderr_text = stderr.decode()
+    if check and proc.returncode != 0:
         logger.error(f"Failed to execute: {command}")
-        logger.error(e.stderr.decode())
+        if stderr_text:
+            logger.error(stderr_text)
         exit(1)
 
+def _mem_total_gb():
+    """Return total system memory in GB, read straight from /proc/meminfo."""
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("MemTotal:"):
+                return int(line.split()[1]) * 1024 / (1024 ** 3)
+    raise RuntimeError("MemTotal not found in /proc/meminfo")
+
+def _disk_free_gb(path="/"):
+    """Return free disk space for path in GB via statvfs."""
+    stats = os.statvfs(path)
+    return stats.f_bavail * stats.f_frsize / (1024 ** 3)
+
 def pre_install_check():
     """Check system resources and prerequisites."""
     logger.info("Performing pre-installation checks...")
-    
-    # Memory check
-    mem = psutil.virtual_memory().total / (1024 ** 3)
-    if mem < 2:
-        logger.warning(f"[WARNING] Available memory is {mem:.2f} GB. Minimum 2GB recommended.")
-    
-    # Disk space check
-    disk = psutil.disk_usage('/').free / (1024 ** 3)
-    if disk < 10:
-        logger.warning(f"[WARNING] Available disk space is {disk:.2f} GB. Minimum 10GB recommended.")
-    
-    # Docker check
-    if subprocess.run("docker --version", shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0:
-        logger.info("[INFO] Docker is already installed.")
-    else:
-        logger.info("[INFO] Docker is not installed. It will be installed.")
 
-def update_and_upgrade_system():
-    """Update and upgrade Ubuntu to the latest version."""
-    run_command("sudo apt update && sudo apt upgrade -y", "Updating and upgrading Ubuntu")
+    # The three probes are independent; fan them out so the check costs
+    # roughly as much as the slowest probe (the docker fork) alone.
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        mem_future = executor.submit(_mem_total_gb)
+        disk_future = executor.submit(_disk_free_gb)
+        docker_future = executor.submit(
+            subprocess.run, ["docker", "--version"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        # Memory check
+        mem = mem_future.result()
+        if mem < 2:
+            logger.warning(f"[WARNING] Available memory is {mem:.2f} GB. Minimum 2GB recommended.")
+
+        # Disk space check
+        disk = disk_future.result()
+        if disk < 10:
+            logger.warning(f"[WARNING] Available disk space is {disk:.2f} GB. Minimum 10GB recommended.")
 
-def install_docker():
+        # Docker check
+        try:
+            docker_installed = docker_future.result().returncode == 0
+        except FileNotFoundError:
+            # No shell is involved, so a missing docker binary raises
+            # instead of returning exit code 127.
+            docker_installed = False
+        if docker_installed:
+            logger.info("[INFO] Docker is already installed.")
+        else:
+            logger.info("[INFO] Docker is not installed. It will be installed.")
+
+def _apt_cache_fresh(ttl=3600):
+    """Return True if the apt package lists were refreshed within ttl seconds."""
+    try:
+        return time.time() - os.path.getmtime("/var/lib/apt/lists") < ttl
+    except OSError:
+        return False
+
+async def update_and_upgrade_system():
+    """Refresh the apt cache (if stale) and optionally upgrade the whole host."""
+    if _apt_cache_fresh():
+        logger.info("apt cache is less than an hour old; skipping 'apt-get update'.")
+    else:
+        await run_command(["sudo", "apt-get", "update"], "Updating package lists")
+    if cli_args.upgrade_host:
+        # Sequential on purpose: both commands contend for the apt lock.
+        await run_command(["sudo", "apt-get", "upgrade", "-y"], "Upgrading Ubuntu packages", stream=True)
+    else:
+        logger.info("Skipping full host upgrade (run with --upgrade-host to enable).")
+
+async def install_docker():
     """Install Docker and create Docker group."""
-    run_command("sudo apt install -y docker.io", "Installing Docker")
-    run_command("sudo systemctl start docker && sudo systemctl enable docker", "Starting and enabling Docker service")
-    run_command("sudo groupadd docker || true", "Creating Docker group (if not exists)")
-    run_command(f"sudo usermod -aG docker {getpass.getuser()}", "Adding current user to Docker group")
+    await run_command(["sudo", "DEBIAN_FRONTEND=noninteractive", "apt-get", "install",
+                       "--no-install-recommends", "-y", "docker.io", "ca-certificates"],
+                      "Installing Docker", stream=True)
+    await run_command(["sudo", "systemctl", "start", "docker"], "Starting Docker service")
+    await run_command(["sudo", "systemctl", "enable", "docker"], "Enabling Docker service")
+
+    # Check group state via grp/pwd before forking sudo: on re-runs both
+    # calls are usually unnecessary.
+    user = pwd.getpwuid(os.getuid()).pw_name
+    try:
+        docker_group = grp.getgrnam("docker")
+    except KeyError:
+        docker_group = None
+        await run_command(["sudo", "groupadd", "docker"], "Creating Docker group", check=False)
+    if docker_group is not None and user in docker_group.gr_mem:
+        logger.info(f"User '{user}' is already in the docker group.")
+    else:
+        await run_command(["sudo", "usermod", "-aG", "docker", user], "Adding current user to Docker group")
 
 def create_thingsboard_user():
     """Create ThingsBoard user and allow the user to set a secure password."""
@@ -67,22 +167,38 @@ def create_thingsboard_user():
 
 def backup_existing_compose_file():
     """Backup the existing docker-compose.yml file if it exists."""
-    if os.path.exists("docker-compose.yml"):
-        backup_file = "docker-compose.yml.bak"
-        os.rename("docker-compose.yml", backup_file)
-        logger.info(f"Existing docker-compose.yml backed up as {backup_file}")
+    backup_file = "docker-compose.yml.bak"
+    try:
+        # Single atomic rename; no exists() check, so no TOCTOU race.
+        os.replace("docker-compose.yml", backup_file)
+    except FileNotFoundError:
+        return
+    logger.info(f"Existing docker-compose.yml backed up as {backup_file}")
 
-def create_docker_network():
+async def create_docker_network():
     """Create a custom Docker network for ThingsBoard."""
     network_name = "thingsboard_net"
-    run_command(f"docker network create {network_name} || true", f"Creating Docker network '{network_name}'")
+    await run_command(["docker", "network", "create", network_name],
+                      f"Creating Docker network '{network_name}'", check=False)
     return network_name
 
+def _prompt_port(label, default):
+    """Prompt for a port and validate it once; returns an int in 1..65535."""
+    while True:
+        raw = input(f"[PROMPT] Enter {label} (default: {default}): ") or default
+        try:
+            port = int(raw)
+            if 1 <= port <= 65535:
+                return port
+        except ValueError:
+            pass
+        print(f"[ERROR] '{raw}' is not a valid port number (1-65535).")
+
 def get_user_config():
     """Prompt the user for custom configuration values."""
-    http_port = input("[PROMPT] Enter HTTP port for ThingsBoard (default: 8080): ") or "8080"
-    mqtt_port = input("[PROMPT] Enter MQTT port (default: 1883): ") or "1883"
-    coap_port = input("[PROMPT] Enter CoAP port (default: 5683): ") or "5683"
+    http_port = _prompt_port("HTTP port for ThingsBoard", 8080)
+    mqtt_port = _prompt_port("MQTT port", 1883)
+    coap_port = _prompt_port("CoAP port", 5683)
     return http_port, mqtt_port, coap_port
 
 def configure_environment():
@@ -101,14 +217,20 @@ def configure_environment():
             "DB_POOL_SIZE": "20"
         }
 
-def install_thingsboard_docker_compose(http_port, mqtt_port, coap_port):
-    """Install ThingsBoard using Docker Compose with custom ports."""
-    compose_file_content = f"""
+_TB_IMAGE = "thingsboard/tb-postgres:latest"
+_PG_IMAGE = "postgres:12"
+
+# Compose file template, built once at import time and parameterized
+# with str.format at write time.
+_COMPOSE_TEMPLATE = """
 version: '3.5'
 services:
   tb:
-    image: thingsboard/tb-postgres:latest
+    image: {tb_image}
     container_name: tb
+    restart: unless-stopped
+    tmpfs:
+      - /var/log/thingsboard:size=256M
     ports:
       - "{http_port}:8080"
       - "{mqtt_port}:1883"
@@ -119,91 +241,246 @@ services:
       SPRING_DATASOURCE_USERNAME: tb_user
       SPRING_DATASOURCE_PASSWORD: tb_password
     depends_on:
-      - postgres
+      postgres:
+        condition: service_healthy
+    healthcheck:
+      test: ["CMD", "curl", "-f", "http://localhost:8080/login"]
+      interval: 10s
+      timeout: 5s
+      retries: 10
+      start_period: 60s
 
   postgres:
-    image: postgres:12
+    image: {pg_image}
     container_name: postgres
+    restart: unless-stopped
     environment:
       POSTGRES_DB: thingsboard
       POSTGRES_USER: tb_user
       POSTGRES_PASSWORD: tb_password
     volumes:
-      - ./data/db:/var/lib/postgresql/data
+      - tb_pgdata:/var/lib/postgresql/data
+    healthcheck:
+      test: ["CMD-SHELL", "pg_isready -U tb_user"]
+      interval: 10s
+      timeout: 5s
+      retries: 10
+      start_period: 10s
+
+volumes:
+  tb_pgdata:
 """
 
-    with open("docker-compose.yml", "w") as f:
+async def install_thingsboard_docker_compose(http_port, mqtt_port, coap_port):
+    """Install ThingsBoard using Docker Compose with custom ports."""
+    compose_file_content = _COMPOSE_TEMPLATE.format(
+        tb_image=_TB_IMAGE, pg_image=_PG_IMAGE,
+        http_port=http_port, mqtt_port=mqtt_port, coap_port=coap_port)
+
+    # Write-and-swap so a Ctrl-C or crash can never leave behind a
+    # partially written compose file.
+    with open("docker-compose.yml.tmp", "w") as f:
         f.write(compose_file_content)
+    os.replace("docker-compose.yml.tmp", "docker-compose.yml")
+
+    # The two image pulls are independent network I/O, so overlap them;
+    # compose up then finds the images locally and pulls nothing.
+    await asyncio.gather(
+        run_command(["docker", "pull", _TB_IMAGE], f"Pulling {_TB_IMAGE}", stream=True),
+        run_command(["docker", "pull", _PG_IMAGE], f"Pulling {_PG_IMAGE}", stream=True),
+    )
+    await run_command(["docker", "compose", "up", "-d", "--wait"],
+                      "Deploying ThingsBoard with Docker Compose", stream=True)
+
+async def configure_firewall(http_port, mqtt_port, coap_port):
+    """Configure firewall to allow ThingsBoard ports (ints, validated at prompt time)."""
+    # The three "allow" rules are independent, so dispatch them concurrently.
+    await asyncio.gather(
+        run_command(["sudo", "ufw", "allow", str(http_port)], f"Allowing HTTP port {http_port}"),
+        run_command(["sudo", "ufw", "allow", str(mqtt_port)], f"Allowing MQTT port {mqtt_port}"),
+        run_command(["sudo", "ufw", "allow", str(coap_port)], f"Allowing CoAP port {coap_port}"),
+    )
+    await run_command(["sudo", "ufw", "enable"], "Enabling the firewall")
 
-    run_command("docker-compose up -d", "Deploying ThingsBoard with Docker Compose")
+async def _container_health_statuses():
+    """Return the health status of every compose-managed container."""
+    proc = await asyncio.create_subprocess_exec(
+        "docker", "compose", "ps", "--format", "json",
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    out, _ = await proc.communicate()
+    text = out.decode().strip()
+    if not text:
+        return []
+    # Compose v2 emits either a JSON array or one JSON object per line
+    # depending on version; accept both.
+    try:
+        entries = json.loads(text)
+        if isinstance(entries, dict):
+            entries = [entries]
+    except json.JSONDecodeError:
+        entries = [json.loads(line) for line in text.splitlines()]
+    return [entry.get("Health") or entry.get("State", "") for entry in entries]
+
+async def verify_installation():
+    """Wait for the ThingsBoard containers to report healthy and print instructions."""
+    await run_command(["docker", "compose", "ps"], "Checking running containers")
+    delay = 5
+    for _ in range(12):
+        statuses = await _container_health_statuses()
+        if statuses and all(status == "healthy" for status in statuses):
+            logger.info("All containers are healthy. ThingsBoard is now accessible via http://<your-ip>:8080")
+            return
+        logger.info(f"Waiting for containers to become healthy (current: {', '.join(statuses) or 'none'})...")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 30)
+    logger.warning("[WARNING] Containers did not report healthy in time. Check 'docker compose ps' manually.")
 
-def configure_firewall(http_port, mqtt_port, coap_port):
-    """Configure firewall to allow ThingsBoard ports."""
-    run_command(f"sudo ufw allow {http_port}", f"Allowing HTTP port {http_port}")
-    run_command(f"sudo ufw allow {mqtt_port}", f"Allowing MQTT port {mqtt_port}")
-    run_command(f"sudo ufw allow {coap_port}", f"Allowing CoAP port {coap_port}")
-    run_command("sudo ufw enable", "Enabling the firewall")
+# Cached SMTP connection, reused across notifications so repeated sends
+# don't pay the TCP + STARTTLS + login round-trips each time.
+_smtp = None
+_SMTP_HOST = "smtp.example.com"
+_SMTP_PORT = 587
 
-def verify_installation():
-    """Check the status of ThingsBoard Docker containers and print instructions."""
-    run_command("docker-compose ps", "Checking running containers")
-    logger.info("ThingsBoard should now be accessible via http://<your-ip>:8080")
+@functools.lru_cache(maxsize=1)
+def _smtp_addr():
+    """Resolve the SMTP host once; repeat sends skip the DNS lookup."""
+    import socket
+    return socket.getaddrinfo(_SMTP_HOST, _SMTP_PORT,
+                              socket.AF_INET, socket.SOCK_STREAM)[0][4][0]
+
+def _smtp_quit():
+    """atexit hook: close the cached connection, ignoring dead sockets."""
+    if _smtp is None:
+        return
+    import smtplib
+    try:
+        _smtp.quit()
+    except (smtplib.SMTPException, OSError):
+        pass
+
+atexit.register(_smtp_quit)
+
+def _smtp_connection():
+    """Return the shared SMTP connection, creating it on first use."""
+    global _smtp
+    if _smtp is None:
+        import smtplib
+        # timeout bounds the TCP connect; without it an unreachable
+        # SMTP host hangs the installer for the kernel default (~2 min).
+        _smtp = smtplib.SMTP(_smtp_addr(), _SMTP_PORT, timeout=10)
+        _smtp.starttls()
+        _smtp.login("user", "password")
+    return _smtp
 
 def send_notification(email, success=True):
     """Send an email notification upon completion."""
+    import smtplib
+    from email.mime.text import MIMEText
+
+    global _smtp
     status = "SUCCESS" if success else "FAILURE"
     msg = MIMEText(f"The ThingsBoard installation completed with status: {status}")
     msg['Subject'] = "ThingsBoard Installation Status"
     msg['From'] = "noreply@example.com"
     msg['To'] = email
 
-    try:
-        with smtplib.SMTP("smtp.example.com", 587) as server:
-            server.starttls()
-            server.login("user", "password")
-            server.sendmail(msg['From'], [msg['To']], msg.as_string())
-        logger.info("[INFO] Notification email sent.")
-    except Exception as e:
-        logger.error(f"[ERROR] Failed to send notification email: {e}")
+    # Two attempts: if the server dropped the idle cached connection,
+    # discard it and retry once with a fresh one.
+    for attempt in (1, 2):
+        try:
+            _smtp_connection().sendmail(msg['From'], [msg['To']], msg.as_string())
+            logger.info("[INFO] Notification email sent.")
+            return
+        except smtplib.SMTPServerDisconnected as e:
+            _smtp = None
+            if attempt == 2:
+                logger.error(f"[ERROR] Failed to send notification email: {e}")
+        except Exception as e:
+            _smtp = None
+            logger.error(f"[ERROR] Failed to send notification email: {e}")
+            return
+
+# Menu text and prompt, colored with plain ANSI escapes and built once
+# at import time instead of via termcolor calls on every iteration.
+_MENU = (
+    "\n\033[1;36m=== ThingsBoard Installation Menu ===\033[0m\n"
+    "\033[32m1. Full Installation\033[0m\n"
+    "\033[33m2. Verify Installation\033[0m\n"
+    "\033[33m3. Configure Firewall\033[0m\n"
+    "\033[34m4. Send Notification Email\033[0m\n"
+    "\033[31m5. Exit\033[0m"
+)
+_PROMPT = "\033[1mEnter your choice [1-5]: \033[0m"
+
+_ACTIONS = {
+    "1": lambda: asyncio.run(full_installation()),
+    "2": lambda: asyncio.run(verify_installation()),
+    "3": lambda: asyncio.run(configure_firewall(8080, 1883, 5683)),
+    "4": lambda: send_notification("admin@example.com"),
+}
 
 def main_menu():
     """Display a menu for user to select operations."""
     while True:
-        print("\n" + colored("=== ThingsBoard Installation Menu ===", "cyan", attrs=["bold"]))
-        print(colored("1. Full Installation", "green"))
-        print(colored("2. Verify Installation", "yellow"))
-        print(colored("3. Configure Firewall", "yellow"))
-        print(colored("4. Send Notification Email", "blue"))
-        print(colored("5. Exit", "red"))
-
-        choice = input(colored("Enter your choice [1-5]: ", "white", attrs=["bold"]))
-
-        if choice == "1":
-            full_installation()
-        elif choice == "2":
-            verify_installation()
-        elif choice == "3":
-            configure_firewall("8080", "1883", "5683")
-        elif choice == "4":
-            send_notification("admin@example.com")
-        elif choice == "5":
-            print(colored("Exiting. Goodbye!", "red"))
+        print(_MENU)
+        choice = input(_PROMPT)
+
+        if choice == "5":
+            print("\033[31mExiting. Goodbye!\033[0m")
             break
+        action = _ACTIONS.get(choice)
+        if action is not None:
+            action()
         else:
-            print(colored("[ERROR] Invalid choice, please try again.", "red"))
+            print("\033[31m[ERROR] Invalid choice, please try again.\033[0m")
 
-def full_installation():
+async def full_installation():
     """Run the full installation process."""
     pre_install_check()
-    update_and_upgrade_system()
-    install_docker()
+    # Cache sudo credentials up front: the background apt task must not
+    # be the first sudo of the session, or its password prompt races
+    # the port prompts for the terminal.
+    await run_command(["sudo", "-v"], "Validating sudo credentials")
+    # Kick off the apt refresh right away; in interactive mode it runs
+    # while the user is still answering the port prompts.
+    apt_task = asyncio.create_task(update_and_upgrade_system())
+    if cli_args.yes:
+        logger.info("Unattended mode: using configured ports without prompting.")
+        http_port, mqtt_port, coap_port = (
+            cli_args.http_port, cli_args.mqtt_port, cli_args.coap_port)
+    else:
+        # input() would block the event loop (and the apt task with it),
+        # so run the prompts in a worker thread.
+        loop = asyncio.get_running_loop()
+        http_port, mqtt_port, coap_port = await loop.run_in_executor(None, get_user_config)
+    await apt_task
+    await install_docker()
     backup_existing_compose_file()
-    http_port, mqtt_port, coap_port = get_user_config()
-    install_thingsboard_docker_compose(http_port, mqtt_port, coap_port)
-    configure_firewall(http_port, mqtt_port, coap_port)
-    verify_installation()
+    # Compose deployment and firewall configuration are independent of
+    # each other, so run them concurrently.
+    await asyncio.gather(
+        install_thingsboard_docker_compose(http_port, mqtt_port, coap_port),
+        configure_firewall(http_port, mqtt_port, coap_port),
+    )
+    await verify_installation()
     send_notification("admin@example.com", success=True)
 
 if __name__ == "__main__":
-    main_menu()
+    parser = argparse.ArgumentParser(description="Install and manage ThingsBoard via Docker Compose.")
+    parser.add_argument("--upgrade-host", action="store_true",
+                        help="Run a full 'apt-get upgrade' of the host before installing (slow)")
+    parser.add_argument("-y", "--yes", action="store_true",
+                        help="Run the full installation unattended with default settings")
+    parser.add_argument("--http-port", type=int, default=8080,
+                        help="HTTP port for ThingsBoard (used with --yes)")
+    parser.add_argument("--mqtt-port", type=int, default=1883,
+                        help="MQTT port (used with --yes)")
+    parser.add_argument("--coap-port", type=int, default=5683,
+                        help="CoAP port (used with --yes)")
+    cli_args = parser.parse_args()
+
+    if cli_args.yes:
+        asyncio.run(full_installation())
+    else:
+        main_menu()
 